@@ -1,4 +1,4 @@
-from langchain_core.messages import BaseMessage, AIMessage, HumanMessage
+from langchain_core.messages import BaseMessage, AIMessage, HumanMessage, message_chunk_to_message
 from langchain_community.tools import DuckDuckGoSearchRun
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.checkpoint.sqlite import SqliteSaver
@@ -7,21 +7,39 @@ from langgraph.graph.message import add_messages
 from langchain_groq import ChatGroq
 from typing import TypedDict, Annotated
 from langchain.tools import tool
+from contextlib import contextmanager
+from functools import lru_cache
+from cachetools import TTLCache, func
+from decimal import Context
 from dotenv import load_dotenv
 from datetime import datetime
 
+import threading
+import hashlib
+import math
+import sys
+import ast
 import sqlite3
+import queue
+import json
 
 load_dotenv()
 
 
 # TOOLS
+search = DuckDuckGoSearchRun()
+
+
+@func.ttl_cache(maxsize=1024, ttl=300)
+def cached_search(query: str) -> str:
+    return search.run(query)
+
+
 @tool()
 def search_web(query: str) -> str:
     """This tool is useful for searching the web for latest and up-to-date information."""
-    search = DuckDuckGoSearchRun()
-    result = search.run(query)
-    return result
+    # the agent often repeats the same query within a conversation
+    return cached_search(" ".join(query.lower().split()))
 
 
 @tool()
@@ -31,12 +49,99 @@ def get_date_time() -> str:
     return now.strftime("%Y-%m-%d %H:%M:%S")
 
 
+# ints grow without bound, so anything that can blow up is capped. Results
+# are kept within what str() will convert (4300 digits by default)
+MAX_RESULT_DIGITS = sys.get_int_max_str_digits() or 4300
+MAX_MODULUS_DIGITS = 100
+MAX_FACTORIAL_N = 1000
+
+
+def bounded_pow(base, exponent, modulus=None):
+    if modulus is not None:
+        if abs(modulus) > 10 ** MAX_MODULUS_DIGITS:
+            raise ValueError("modulus is too large")
+        return pow(base, exponent, modulus)
+
+    if (isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1
+            and exponent * math.log10(abs(base)) >= MAX_RESULT_DIGITS):
+        raise ValueError("result is too large")
+    return pow(base, exponent)
+
+
+def bounded_round(number, ndigits=None):
+    # round(5, -10**8) builds 10**(10**8) internally before rounding
+    if ndigits is not None and abs(ndigits) > MAX_RESULT_DIGITS:
+        raise ValueError("round() ndigits is too large")
+    return round(number, ndigits)
+
+
+def bounded(function):
+    def wrapper(n, *args):
+        if n > MAX_FACTORIAL_N:
+            raise ValueError(f"{function.__name__}() argument is too large")
+        return function(n, *args)
+    return wrapper
+
+
+# names the calculator understands, e.g. "sqrt(2) * pi"
+CALCULATOR_NAMES = {name: value for name, value in vars(math).items()
+                    if not name.startswith("_")}
+CALCULATOR_NAMES.update(abs=abs, min=min, max=max,
+                        round=bounded_round, pow=bounded_pow,
+                        factorial=bounded(math.factorial),
+                        comb=bounded(math.comb), perm=bounded(math.perm))
+
+# bit shifts are left out, 1 << 10**9 is as costly as a huge power
+CALCULATOR_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Constant,
+                    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+                    ast.UAdd, ast.USub, ast.expr_context)
+
+
+class PowToCall(ast.NodeTransformer):
+    """Rewrite `a ** b` as `pow(a, b)` so it goes through bounded_pow."""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Pow):
+            call = ast.Call(func=ast.Name(id="pow", ctx=ast.Load()),
+                            args=[node.left, node.right], keywords=[])
+            return ast.copy_location(call, node)
+        return node
+
+
+@lru_cache(maxsize=1024)
+def compile_expression(expression: str):
+    """Parse an arithmetic expression, reject anything else, and cache the code object."""
+    tree = ast.parse(expression, mode="eval")
+
+    for node in ast.walk(tree):
+        if not isinstance(node, CALCULATOR_NODES):
+            raise ValueError(f"unsupported syntax: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in CALCULATOR_NAMES:
+            raise ValueError(f"unknown name: {node.id}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex)):
+            raise ValueError(f"unsupported value: {node.value!r}")
+
+    tree = ast.fix_missing_locations(PowToCall().visit(tree))
+    return compile(tree, "<calculator>", "eval")
+
+
+def format_result(result) -> str:
+    """str() the result, falling back to scientific notation for huge ints."""
+    try:
+        return str(result)
+    except ValueError:
+        # products like 10**4000 * 10**4000 still pass the per-call caps
+        return format(Context(prec=16).create_decimal(result), "e")
+
+
 @tool()
 def calculator_tool(expression: str) -> str:
     """This tool is useful for performing calculations."""
     try:
-        result = eval(expression)
-        return str(result)
+        result = eval(compile_expression(expression),
+                      {"__builtins__": {}}, CALCULATOR_NAMES)
+        return format_result(result)
 
     except Exception as e:
         return f"Error in calculation: {str(e)}"
@@ -45,8 +150,26 @@ def calculator_tool(expression: str) -> str:
 tools = [search_web, get_date_time, calculator_tool]
 
 
-llm = ChatGroq(model="openai/gpt-oss-120b",
-               temperature=0.8).bind_tools(tools)
+chat_model = ChatGroq(model="openai/gpt-oss-120b",
+                     temperature=0.8)
+llm = chat_model.bind_tools(tools)
+
+
+# RESPONSE CACHE
+response_cache = TTLCache(maxsize=1024, ttl=600)
+# cachetools caches aren't thread safe and Streamlit serves sessions from threads
+response_cache_lock = threading.Lock()
+
+
+def make_key(messages: list[BaseMessage]) -> str:
+    # message ids differ between threads, so key on the conversation content only
+    conversation = [
+        [message.type, message.content,
+         [[call["name"], call["args"]] for call in getattr(message, "tool_calls", [])]]
+        for message in messages
+    ]
+    raw = f"{chat_model.model_name}|{chat_model.temperature}|{json.dumps(conversation, default=str)}"
+    return hashlib.sha256(raw.encode()).hexdigest()
 
 
 class ChatState(TypedDict):
@@ -55,14 +178,57 @@ class ChatState(TypedDict):
 
 def chat_node(state: ChatState):
     messages = state['messages']
-    response = llm.invoke(messages)
+
+    key = make_key(messages)
+    with response_cache_lock:
+        cached = response_cache.get(key)
+    if cached is not None:
+        # fresh id so add_messages appends the reply instead of replacing one
+        return {"messages": [cached.model_copy(update={"id": None})]}
+
+    # stream the completion so clients using stream_mode="messages" get
+    # tokens as they arrive, then merge the chunks (including any tool call
+    # chunks) into a single message for the checkpoint
+    response = None
+    for chunk in llm.stream(messages):
+        response = chunk if response is None else response + chunk
+
+    response = message_chunk_to_message(response)
+    with response_cache_lock:
+        response_cache[key] = response
+
     return {"messages": [response]}
 
 
 # Checkpointer
 # create the database file if it doesn't exist
 conn = sqlite3.connect("chatbot.db", check_same_thread=False)
+conn.execute("PRAGMA journal_mode=WAL")
+conn.execute("PRAGMA synchronous=NORMAL")
+conn.execute("PRAGMA wal_autocheckpoint=1000")
+conn.execute("PRAGMA temp_store=MEMORY")
+conn.execute("PRAGMA mmap_size=268435456")
 checkpointer = SqliteSaver(conn=conn)
+# create the tables now, the read-only connections below need them
+checkpointer.setup()
+
+# read-only connections for queries outside the checkpointer, with WAL they
+# don't block (or wait on) checkpoint writes
+READ_POOL_SIZE = 4
+read_pool = queue.Queue()
+for _ in range(READ_POOL_SIZE):
+    read_pool.put(sqlite3.connect("file:chatbot.db?mode=ro",
+                                  uri=True, check_same_thread=False))
+
+
+@contextmanager
+def read_connection():
+    ro_conn = read_pool.get()
+    try:
+        yield ro_conn
+    finally:
+        read_pool.put(ro_conn)
+
 
 graph = StateGraph(ChatState)
 graph.add_node("chat_node", chat_node)
@@ -82,8 +248,8 @@ chatbot = graph.compile(checkpointer=checkpointer)
 
 
 def get_threads_in_db():
-    all_threads = set()
-    for checkpoint in checkpointer.list(None):
-        all_threads.add(checkpoint.config['configurable']['thread_id'])
-
-    return list(all_threads)
+    # thread_id leads the checkpoints primary key, so this is an index-only
+    # scan that never touches (or deserializes) the checkpoint blobs
+    with read_connection() as ro_conn:
+        rows = ro_conn.execute("SELECT DISTINCT thread_id FROM checkpoints")
+        return [row[0] for row in rows]
@@ -1,8 +1,14 @@
 import streamlit as st
 from langgraph.graph import START, END, StateGraph
+from langgraph.types import Send
 from langchain_ollama import ChatOllama
-from typing import TypedDict
+from langchain_core.prompts import ChatPromptTemplate
+from typing import TypedDict, Annotated
+from statistics import mean
 from pydantic import BaseModel, Field
+from llm_cache import cached_ainvoke
+import threading
+import asyncio
 
 # ---------------- PAGE CONFIG ----------------
 st.set_page_config(
@@ -14,12 +20,28 @@ st.set_page_config(
 # ---------------- STATE ----------------
 
 
+def collect_drafts(drafts: list[str], new: list[str]) -> list[str]:
+    # an empty update clears the drafts once score_blog has judged them
+    if not new:
+        return []
+    return drafts + new
+
+
 class BlogState(TypedDict):
     topic: str
     outline: str
     final_blog: str
     blog_score: float
     feedback: str
+    candidates: Annotated[list[str], collect_drafts]
+    iterations: int
+    prev_score: float
+
+
+class DraftState(TypedDict):
+    outline: str
+    feedback: str
+    seed: int
 
 
 # ---------------- STRUCTURED OUTPUT ----------------
@@ -32,80 +54,189 @@ class BlogEvaluation(BaseModel):
 
 # ---------------- MODELS ----------------
 
+NUM_DRAFTS = 4
+
+
 @st.cache_resource
 def get_models():
     llm = ChatOllama(model="deepseek-v3.1:671b-cloud", temperature=0.7)
-    llm_judge = ChatOllama(model="deepseek-v3.1:671b-cloud", temperature=0.0)
-    return llm, llm_judge
+    # judging is a constrained scoring task, a small local model is enough and
+    # much faster, the 671B model is kept for writing. Local decoding is memory
+    # bound, so pin the 4-bit weights and run the server with an 8-bit KV cache:
+    #   OLLAMA_FLASH_ATTENTION=1 OLLAMA_KV_CACHE_TYPE=q8_0 ollama serve
+    llm_judge = ChatOllama(model="llama3.1:8b-instruct-q4_K_M", temperature=0.0, num_ctx=8192)
+    judge = llm_judge.with_structured_output(BlogEvaluation)
 
+    # one writer per parallel draft, spread around the base temperature
+    writers = [ChatOllama(model="deepseek-v3.1:671b-cloud", temperature=0.5 + 0.15 * seed)
+               for seed in range(NUM_DRAFTS)]
 
-llm, llm_judge = get_models()
+    return llm, llm_judge, judge, writers
 
 
-# ---------------- NODES ----------------
+llm, llm_judge, judge, writers = get_models()
 
-def create_outline(state: BlogState) -> BlogState:
-    prompt = f"Create a detailed blog outline on: {state['topic']}"
-    state["outline"] = llm.invoke(prompt).content
-    return state
 
+# ---------------- EVENT LOOP ----------------
 
-def create_blog(state: BlogState) -> BlogState:
-    outline = state["outline"]
-    feedback = state.get("feedback", "")
+@st.cache_resource
+def get_event_loop():
+    # one long-lived loop shared by every session, so the async Ollama
+    # clients cached in get_models() are never bound to a closed loop
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def iter_async(agen):
+    """Drive an async generator on the shared loop from the script thread."""
+    loop = get_event_loop()
+    while True:
+        try:
+            yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+        except StopAsyncIteration:
+            return
 
-    if feedback:
-        prompt = f"""
-Improve the blog using this feedback:
 
-Feedback:
-{feedback}
+# ---------------- PROMPTS ----------------
+
+# parsed once here, the nodes only fill in the variables
+OUTLINE_PROMPT = ChatPromptTemplate.from_template(
+    "Create a detailed blog outline on: {topic}")
+
+BLOG_PROMPT = ChatPromptTemplate.from_template("""
+Write a detailed blog based on this outline:
 
-Blog outline:
 {outline}
+""")
 
-Rewrite the blog better.
-"""
-    else:
-        prompt = f"""
+# starts exactly like BLOG_PROMPT and keeps the feedback at the end, so every
+# round shares the outline prefix. Whether that prefill is reused depends on
+# the server: the writers are a cloud model, so it's up to Ollama's hosted
+# inference, not anything configured here
+BLOG_REFINE_PROMPT = ChatPromptTemplate.from_template("""
 Write a detailed blog based on this outline:
 
 {outline}
-"""
 
-    state["final_blog"] = llm.invoke(prompt).content
-    return state
+---
+FEEDBACK (apply to this revision):
+{feedback}
 
+Rewrite the blog better, addressing the feedback.
+""")
 
-def score_blog(state: BlogState) -> BlogState:
-    prompt = f"""
-Evaluate the blog based on how well it follows the outline.
+# each aspect gets its own smaller judge call, all of them run in parallel
+JUDGE_ASPECTS = {
+    "structure": "how well the blog follows the sections and order of the outline",
+    "content": "the accuracy, depth and usefulness of the information",
+    "style": "the clarity, tone and readability of the writing",
+}
 
-Outline:
-{state['outline']}
+SCORE_PROMPT = ChatPromptTemplate.from_template("""
+Evaluate the {aspect} of the blog: {criteria}.
 
-Blog:
-{state['final_blog']}
+{outline_section}Blog:
+{blog}
 
 Return JSON only:
-{{"score": number between 0 and 10, "feedback": "how to improve"}}
-"""
+{{"score": number between 0 and 10, "feedback": "how to improve the {aspect}"}}
+""")
 
-    judge = llm_judge.with_structured_output(BlogEvaluation)
-    result = judge.invoke(prompt)
 
-    state["blog_score"] = result.score
-    state["feedback"] = result.feedback
+# ---------------- NODES ----------------
+
+async def create_outline(state: BlogState) -> BlogState:
+    prompt = OUTLINE_PROMPT.format_messages(topic=state["topic"])
+    state["outline"] = (await cached_ainvoke(llm, prompt)).content
+    return state
+
+
+def dispatch_drafts(state: BlogState) -> list[Send]:
+    # write NUM_DRAFTS candidates in parallel, score_blog keeps the best one
+    return [
+        Send("blog_node", {"outline": state["outline"],
+                           "feedback": state.get("feedback", ""),
+                           "seed": seed})
+        for seed in range(NUM_DRAFTS)
+    ]
+
+
+async def create_blog(state: DraftState) -> BlogState:
+    outline = state["outline"]
+    feedback = state["feedback"]
+    writer = writers[state["seed"]]
+
+    if feedback:
+        prompt = BLOG_REFINE_PROMPT.format_messages(feedback=feedback, outline=outline)
+    else:
+        prompt = BLOG_PROMPT.format_messages(outline=outline)
+
+    response = await cached_ainvoke(writer, prompt)
+
+    return {"candidates": [response.content]}
+
+
+async def judge_aspect(outline: str, blog: str, aspect: str) -> BlogEvaluation:
+    # only the structure judgment needs the outline
+    outline_section = f"Outline:\n{outline}\n\n" if aspect == "structure" else ""
+
+    prompt = SCORE_PROMPT.format_messages(aspect=aspect, criteria=JUDGE_ASPECTS[aspect],
+                                          outline_section=outline_section, blog=blog)
+
+    return await cached_ainvoke(llm_judge, prompt, runnable=judge, kind="judge")
+
+
+async def judge_blog(outline: str, blog: str) -> BlogEvaluation:
+    results = await asyncio.gather(
+        *[judge_aspect(outline, blog, aspect) for aspect in JUDGE_ASPECTS])
+
+    return BlogEvaluation(
+        score=round(mean(result.score for result in results), 2),
+        feedback="\n".join(f"{aspect.title()}: {result.feedback}"
+                           for aspect, result in zip(JUDGE_ASPECTS, results))
+    )
+
+
+async def score_blog(state: BlogState) -> BlogState:
+    drafts = state["candidates"]
+    results = await asyncio.gather(
+        *[judge_blog(state["outline"], draft) for draft in drafts])
+
+    best = max(range(len(drafts)), key=lambda i: results[i].score)
+
+    state["iterations"] = state.get("iterations", 0) + 1
+    if "blog_score" in state:
+        state["prev_score"] = state["blog_score"]
+
+    # keep the best blog seen so far, a worse round must not replace it
+    if "blog_score" not in state or results[best].score > state["blog_score"]:
+        state["final_blog"] = drafts[best]
+        state["blog_score"] = results[best].score
+        state["feedback"] = results[best].feedback
+    state["candidates"] = []  # clear the judged drafts for the next round
 
     return state
 
 
 # ---------------- ROUTER ----------------
 
-def blog_optimizer(state: BlogState) -> str:
-    if state["blog_score"] < 7.0:
-        return "optimize blog"
-    return "end"
+MAX_ITERATIONS = 3
+MIN_IMPROVEMENT = 0.3
+
+
+def blog_optimizer(state: BlogState):
+    if state["blog_score"] >= 7.0:
+        return END
+
+    # every round is a full set of drafts plus judging, so stop once the
+    # budget is spent or the last round barely moved the best score
+    if state["iterations"] >= MAX_ITERATIONS:
+        return END
+    if "prev_score" in state and state["blog_score"] - state["prev_score"] < MIN_IMPROVEMENT:
+        return END
+
+    return dispatch_drafts(state)
 
 
 # ---------------- GRAPH ----------------
@@ -119,16 +250,17 @@ def build_graph():
     graph.add_node("score_node", score_blog)
 
     graph.add_edge(START, "outline_node")
-    graph.add_edge("outline_node", "blog_node")
+    graph.add_conditional_edges(
+        source="outline_node",
+        path=dispatch_drafts,
+        path_map=["blog_node"]
+    )
     graph.add_edge("blog_node", "score_node")
 
     graph.add_conditional_edges(
         source="score_node",
         path=blog_optimizer,
-        path_map={
-            "optimize blog": "blog_node",
-            "end": END
-        }
+        path_map=["blog_node", END]
     )
 
     return graph.compile()
@@ -147,13 +279,13 @@ st.divider()
 # Sidebar for configuration
 with st.sidebar:
     st.header("⚙️ Configuration")
-    st.info("Using **DeepSeek-V3.1** model")
+    st.info("Writing with **DeepSeek-V3.1**, judging with **Llama 3.1 8B** (local)")
     st.markdown("""
     **How it works:**
     1. 📝 Creates an outline
-    2. ✍️ Writes the blog
-    3. 🔍 Scores the quality (0-10)
-    4. 🔄 Refines if score < 7.0
+    2. ✍️ Writes 4 drafts in parallel
+    3. 🔍 Scores each draft (0-10) and keeps the best
+    4. 🔄 Refines if score < 7.0 (up to 3 rounds)
     5. ✅ Returns final blog
     """)
 
@@ -182,19 +314,61 @@ st.divider()
 if generate_button and topic:
     with st.spinner("🤖 AI is working on your blog..."):
 
-        # Progress tracking
-        progress_placeholder = st.empty()
-        outline_placeholder = st.empty()
-        iterations_placeholder = st.empty()
-
         try:
             # Stream events for real-time updates
-            iteration_count = 0
-
-            with st.status("Processing...", expanded=True) as status:
-                st.write("📝 Creating outline...")
-
-                response = app.invoke({"topic": topic})
+            with st.status("📝 Creating outline...", expanded=True) as status:
+                outline_placeholder = st.empty()
+                draft_placeholders = [column.empty()
+                                      for column in st.columns(NUM_DRAFTS)]
+
+                response = None
+                outline_text = ""
+                draft_texts = {}  # checkpoint namespace -> text, one per parallel draft
+                scored_rounds = 0
+
+                # "messages" yields LLM tokens as they arrive, "values" the
+                # state after every step
+                events = app.astream({"topic": topic},
+                                     stream_mode=["messages", "values"])
+
+                for mode, payload in iter_async(events):
+                    if mode == "values":
+                        response = payload
+
+                        if payload.get("candidates"):
+                            status.update(label="🔍 Scoring drafts...")
+                        elif payload.get("iterations", 0) > scored_rounds:
+                            # a round was just scored, the next one starts
+                            # with empty columns (cached drafts stream nothing)
+                            scored_rounds = payload["iterations"]
+                            draft_texts.clear()
+                            for placeholder in draft_placeholders:
+                                placeholder.empty()
+
+                            status.update(
+                                label=f"📊 Round {scored_rounds} best score: {payload['blog_score']}/10")
+                        elif payload.get("outline") and not outline_text:
+                            # cached outlines arrive without any tokens
+                            outline_placeholder.markdown(payload["outline"])
+                        continue
+
+                    chunk, metadata = payload
+                    node = metadata.get("langgraph_node")
+
+                    if node == "outline_node":
+                        outline_text += chunk.content
+                        outline_placeholder.markdown(outline_text)
+
+                    elif node == "blog_node":
+                        namespace = metadata["langgraph_checkpoint_ns"]
+                        if namespace not in draft_texts:
+                            status.update(label="✍️ Writing drafts...")
+                            draft_texts[namespace] = ""
+
+                        draft_texts[namespace] += chunk.content
+                        slot = list(draft_texts).index(namespace)
+                        draft_placeholders[slot].markdown(
+                            draft_texts[namespace])
 
                 status.update(label="✅ Blog generated successfully!",
                               state="complete", expanded=False)
@@ -252,17 +426,18 @@ if generate_button and topic:
                 st.json({
                     "topic": response["topic"],
                     "final_score": response["blog_score"],
-                    "workflow": "outline → blog → score → conditional refinement loop"
+                    "iterations": response["iterations"],
+                    "workflow": "outline → parallel drafts → score best → conditional refinement loop"
                 })
 
                 st.markdown("### Graph Visualization")
                 st.markdown("""
                 ```
-                START → Outline Node → Blog Node → Score Node
-                                         ↑            ↓
-                                         └────(if score < 7)
-                                                   ↓
-                                                  END (if score ≥ 7)
+                START → Outline Node → Blog Node ×4 → Score Node
+                                         ↑               ↓
+                                         └───────(if score < 7)
+                                                      ↓
+                                                     END (if score ≥ 7)
                 ```
                 """)
 
@@ -0,0 +1,41 @@
+"""
+In-process response cache for the blog agent's LLM calls
+"""
+
+from langchain_core.load import dumps
+from cachetools import TTLCache
+import hashlib
+
+
+# LRU eviction plus per-entry expiry. Only touched from the event loop
+# thread, so it needs no lock
+response_cache = TTLCache(maxsize=10_000, ttl=3600)
+
+
+def make_key(llm, prompt, kind: str) -> str:
+    text = prompt if isinstance(prompt, str) else dumps(prompt)
+    raw = f"{kind}|{llm.model}|{llm.temperature}|{text}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def cached_ainvoke(llm, prompt, runnable=None, kind: str = None):
+    """
+    Await `llm.ainvoke(prompt)`, reusing the stored response for identical
+    (model, temperature, prompt) calls.
+
+    Pass `runnable` to call something built on top of `llm` (e.g. a
+    with_structured_output judge) while still keying on the base model.
+    It returns a different type than `llm`, so it needs its own `kind`
+    (e.g. "judge") to keep its entries apart from the plain messages.
+    """
+    if runnable is not None and kind is None:
+        raise ValueError("cached_ainvoke needs a kind when a runnable is passed")
+
+    key = make_key(llm, prompt, kind or "message")
+    response = response_cache.get(key)
+
+    if response is None:
+        response = await (runnable or llm).ainvoke(prompt)
+        response_cache[key] = response
+
+    return response
@@ -1,17 +1,38 @@
 from langgraph.graph import START, END, StateGraph
+from langgraph.types import Send
 from langchain_ollama import ChatOllama
+from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
-from typing import TypedDict
+from llm_cache import cached_ainvoke
+from typing import TypedDict, Annotated
+from statistics import mean
+import asyncio
 
 # ---------------- STATE ----------------
 
 
+def collect_drafts(drafts: list[str], new: list[str]) -> list[str]:
+    # an empty update clears the drafts once score_blog has judged them
+    if not new:
+        return []
+    return drafts + new
+
+
 class BlogState(TypedDict):
     topic: str
     outline: str
     final_blog: str
     blog_score: float
     feedback: str
+    candidates: Annotated[list[str], collect_drafts]
+    iterations: int
+    prev_score: float
+
+
+class DraftState(TypedDict):
+    outline: str
+    feedback: str
+    seed: int
 
 
 # ---------------- STRUCTURED OUTPUT ----------------
@@ -24,74 +45,160 @@ class BlogEvaluation(BaseModel):
 
 # ---------------- MODELS ----------------
 
+NUM_DRAFTS = 4
+
 llm = ChatOllama(model="deepseek-v3.1:671b-cloud", temperature=0.7)
-llm_judge = ChatOllama(model="deepseek-v3.1:671b-cloud", temperature=0.0)
+# judging is a constrained scoring task, a small local model is enough and
+# much faster, the 671B model is kept for writing. Local decoding is memory
+# bound, so pin the 4-bit weights and run the server with an 8-bit KV cache:
+#   OLLAMA_FLASH_ATTENTION=1 OLLAMA_KV_CACHE_TYPE=q8_0 ollama serve
+llm_judge = ChatOllama(model="llama3.1:8b-instruct-q4_K_M", temperature=0.0, num_ctx=8192)
+judge = llm_judge.with_structured_output(BlogEvaluation)
+
+# one writer per parallel draft, spread around the base temperature
+writers = [ChatOllama(model="deepseek-v3.1:671b-cloud", temperature=0.5 + 0.15 * seed)
+           for seed in range(NUM_DRAFTS)]
+
+
+# ---------------- PROMPTS ----------------
+
+# parsed once here, the nodes only fill in the variables
+OUTLINE_PROMPT = ChatPromptTemplate.from_template(
+    "Create a detailed blog outline on: {topic}")
+
+BLOG_PROMPT = ChatPromptTemplate.from_template("""
+Write a detailed blog based on this outline:
+
+{outline}
+""")
+
+# starts exactly like BLOG_PROMPT and keeps the feedback at the end, so every
+# round shares the outline prefix. Whether that prefill is reused depends on
+# the server: the writers are a cloud model, so it's up to Ollama's hosted
+# inference, not anything configured here
+BLOG_REFINE_PROMPT = ChatPromptTemplate.from_template("""
+Write a detailed blog based on this outline:
+
+{outline}
+
+---
+FEEDBACK (apply to this revision):
+{feedback}
+
+Rewrite the blog better, addressing the feedback.
+""")
+
+# each aspect gets its own smaller judge call, all of them run in parallel
+JUDGE_ASPECTS = {
+    "structure": "how well the blog follows the sections and order of the outline",
+    "content": "the accuracy, depth and usefulness of the information",
+    "style": "the clarity, tone and readability of the writing",
+}
+
+SCORE_PROMPT = ChatPromptTemplate.from_template("""
+Evaluate the {aspect} of the blog: {criteria}.
+
+{outline_section}Blog:
+{blog}
+
+Return JSON only:
+{{"score": number between 0 and 10, "feedback": "how to improve the {aspect}"}}
+""")
 
 
 # ---------------- NODES ----------------
 
-def create_outline(state: BlogState) -> BlogState:
-    prompt = f"Create a detailed blog outline on: {state['topic']}"
-    state["outline"] = llm.invoke(prompt).content
+async def create_outline(state: BlogState) -> BlogState:
+    prompt = OUTLINE_PROMPT.format_messages(topic=state["topic"])
+    state["outline"] = (await cached_ainvoke(llm, prompt)).content
     return state
 
 
-def create_blog(state: BlogState) -> BlogState:
+def dispatch_drafts(state: BlogState) -> list[Send]:
+    # write NUM_DRAFTS candidates in parallel, score_blog keeps the best one
+    return [
+        Send("blog_node", {"outline": state["outline"],
+                           "feedback": state.get("feedback", ""),
+                           "seed": seed})
+        for seed in range(NUM_DRAFTS)
+    ]
+
+
+async def create_blog(state: DraftState) -> BlogState:
     outline = state["outline"]
-    feedback = state.get("feedback", "")
+    feedback = state["feedback"]
+    writer = writers[state["seed"]]
 
     if feedback:
-        prompt = f"""
-Improve the blog using this feedback:
+        prompt = BLOG_REFINE_PROMPT.format_messages(feedback=feedback, outline=outline)
+    else:
+        prompt = BLOG_PROMPT.format_messages(outline=outline)
 
-Feedback:
-{feedback}
+    response = await cached_ainvoke(writer, prompt)
 
-Blog outline:
-{outline}
+    return {"candidates": [response.content]}
 
-Rewrite the blog better.
-"""
-    else:
-        prompt = f"""
-Write a detailed blog based on this outline:
 
-{outline}
-"""
+async def judge_aspect(outline: str, blog: str, aspect: str) -> BlogEvaluation:
+    # only the structure judgment needs the outline
+    outline_section = f"Outline:\n{outline}\n\n" if aspect == "structure" else ""
 
-    state["final_blog"] = llm.invoke(prompt).content
-    return state
+    prompt = SCORE_PROMPT.format_messages(aspect=aspect, criteria=JUDGE_ASPECTS[aspect],
+                                          outline_section=outline_section, blog=blog)
 
+    return await cached_ainvoke(llm_judge, prompt, runnable=judge, kind="judge")
 
-def score_blog(state: BlogState) -> BlogState:
-    prompt = f"""
-Evaluate the blog based on how well it follows the outline.
 
-Outline:
-{state['outline']}
+async def judge_blog(outline: str, blog: str) -> BlogEvaluation:
+    results = await asyncio.gather(
+        *[judge_aspect(outline, blog, aspect) for aspect in JUDGE_ASPECTS])
 
-Blog:
-{state['final_blog']}
+    return BlogEvaluation(
+        score=round(mean(result.score for result in results), 2),
+        feedback="\n".join(f"{aspect.title()}: {result.feedback}"
+                           for aspect, result in zip(JUDGE_ASPECTS, results))
+    )
 
-Return JSON only:
-{{"score": number between 0 and 10, "feedback": "how to improve"}}
-"""
 
-    judge = llm_judge.with_structured_output(BlogEvaluation)
-    result = judge.invoke(prompt)
+async def score_blog(state: BlogState) -> BlogState:
+    drafts = state["candidates"]
+    results = await asyncio.gather(
+        *[judge_blog(state["outline"], draft) for draft in drafts])
 
-    state["blog_score"] = result.score
-    state["feedback"] = result.feedback
+    best = max(range(len(drafts)), key=lambda i: results[i].score)
+
+    state["iterations"] = state.get("iterations", 0) + 1
+    if "blog_score" in state:
+        state["prev_score"] = state["blog_score"]
+
+    # keep the best blog seen so far, a worse round must not replace it
+    if "blog_score" not in state or results[best].score > state["blog_score"]:
+        state["final_blog"] = drafts[best]
+        state["blog_score"] = results[best].score
+        state["feedback"] = results[best].feedback
+    state["candidates"] = []  # clear the judged drafts for the next round
 
     return state
 
 
 # ---------------- ROUTER ----------------
 
-def blog_optimizer(state: BlogState) -> str:
-    if state["blog_score"] < 7.0:
-        return "optimize blog"
-    return "end"
+MAX_ITERATIONS = 3
+MIN_IMPROVEMENT = 0.3
+
+
+def blog_optimizer(state: BlogState):
+    if state["blog_score"] >= 7.0:
+        return END
+
+    # every round is a full set of drafts plus judging, so stop once the
+    # budget is spent or the last round barely moved the best score
+    if state["iterations"] >= MAX_ITERATIONS:
+        return END
+    if "prev_score" in state and state["blog_score"] - state["prev_score"] < MIN_IMPROVEMENT:
+        return END
+
+    return dispatch_drafts(state)
 
 
 # ---------------- GRAPH ----------------
@@ -103,16 +210,17 @@ graph.add_node("blog_node", create_blog)
 graph.add_node("score_node", score_blog)
 
 graph.add_edge(START, "outline_node")
-graph.add_edge("outline_node", "blog_node")
+graph.add_conditional_edges(
+    source="outline_node",
+    path=dispatch_drafts,
+    path_map=["blog_node"]
+)
 graph.add_edge("blog_node", "score_node")
 
 graph.add_conditional_edges(
     source="score_node",
     path=blog_optimizer,
-    path_map={
-        "optimize blog": "blog_node",
-        "end": END
-    }
+    path_map=["blog_node", END]
 )
 
 app = graph.compile()
@@ -120,10 +228,11 @@ app = graph.compile()
 
 # ---------------- RUN ----------------
 
-response = app.invoke({
+response = asyncio.run(app.ainvoke({
     "topic": "Cats vs Dogs: Which Pet Is Better?"
-})
+}))
 
 print("\nFINAL BLOG:\n", response["final_blog"])
 print("\nSCORE:", response["blog_score"])
+print("\nITERATIONS:", response["iterations"])
 print("\nLAST FEEDBACK:\n", response["feedback"])
@@ -4,17 +4,20 @@ Stock Market Trading Agent - Simple Streamlit UI
 
 import streamlit as st
 from langgraph.prebuilt import ToolNode, tools_condition
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.graph import StateGraph, START
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from langgraph.graph.message import add_messages
 from langgraph.types import interrupt, Command
 from typing import TypedDict, Annotated, List
 from langchain_groq import ChatGroq
 from langchain_core.tools import tool
 from dotenv import load_dotenv
+from collections import deque
 from datetime import datetime
 import yfinance as yf
+import sqlite3
+import uuid
 
 load_dotenv()
 
@@ -28,6 +31,32 @@ class AgentState(TypedDict):
     messages: Annotated[List, add_messages]
 
 
+# ----------------- Yahoo Finance Caching ----------------- #
+
+# prices are cached briefly so repeated questions skip the Yahoo round trip.
+# Streamlit computes each cache key under its own lock, so when several
+# sessions ask for the same (symbol, period) at once only the first one calls
+# Yahoo and the others wait for its result.
+PRICE_TTL_SECONDS = 30
+
+
+@st.cache_resource(max_entries=512, show_spinner=False)
+def get_ticker(symbol: str) -> yf.Ticker:
+    return yf.Ticker(symbol)
+
+
+@st.cache_data(ttl=PRICE_TTL_SECONDS, max_entries=512, show_spinner=False)
+def get_history(symbol: str, period: str):
+    return get_ticker(symbol).history(period=period)
+
+
+@st.cache_data(ttl=PRICE_TTL_SECONDS, max_entries=512, show_spinner=False)
+def download_history(symbols: tuple, period: str):
+    # one request for all symbols instead of one per ticker
+    return yf.download(tickers=" ".join(symbols), period=period,
+                       group_by="ticker", threads=True, progress=False)
+
+
 # Tool 1 - get the current stock price for a given company
 @tool
 def get_stock_price(ticker_symbol: str, period: str = "1d") -> float:
@@ -45,10 +74,10 @@ def get_stock_price(ticker_symbol: str, period: str = "1d") -> float:
     Example inputs: 'TSLA' (Tesla), 'AAPL' (Apple), 'RELIANCE.NS' (Reliance), 'GOOGL' (Google), 'AMZN' (Amazon)
     """
     symbol = ticker_symbol.upper().strip()
+    period = period.lower().strip()
 
     try:
-        stock = yf.Ticker(symbol)
-        history = stock.history(period=period)
+        history = get_history(symbol, period)
 
         if history.empty:
             return f"Error: No data found for symbol '{symbol}'. Check if the ticker is correct."
@@ -60,7 +89,45 @@ def get_stock_price(ticker_symbol: str, period: str = "1d") -> float:
         return f"An error occurred: {e}"
 
 
-# Tool 2 - buy stocks for a given company
+# Tool 2 - get the current stock prices for several companies at once
+@tool
+def get_stock_prices(ticker_symbols: List[str], period: str = "1d") -> dict:
+    """
+    This tool fetches the current stock prices for several ticker symbols in a single request. Use it instead of calling get_stock_price once per ticker.
+
+    Args:
+        ticker_symbols (List[str]): The ticker symbols to look up.
+        period (str): The period for which to fetch the stock prices. Default is '1d' (1 day). for example '1d' : 1 Day, '5d': 5 Days, '1mo': 1 Month, '3mo': 3 Months, '6mo': 6 Months, '1y': 1 Year...
+
+    returns:
+        A mapping of each ticker symbol to its current stock price.
+    """
+    symbols = tuple(sorted({symbol.upper().strip()
+                    for symbol in ticker_symbols}))
+    period = period.lower().strip()
+
+    try:
+        data = download_history(symbols, period)
+        prices = {}
+
+        for symbol in symbols:
+            if symbol not in data.columns.get_level_values(0):
+                prices[symbol] = f"Error: No data found for symbol '{symbol}'."
+                continue
+
+            closes = data[symbol]["Close"].dropna()
+            if closes.empty:
+                prices[symbol] = f"Error: No data found for symbol '{symbol}'."
+            else:
+                prices[symbol] = round(float(closes.iloc[-1]), 2)
+
+        return prices
+
+    except Exception as e:
+        return f"An error occurred: {e}"
+
+
+# Tool 3 - buy stocks for a given company
 @tool
 def buy_stocks(ticker_symbol: str, quantity: int, total_price: float) -> str:
     """
@@ -87,7 +154,7 @@ def buy_stocks(ticker_symbol: str, quantity: int, total_price: float) -> str:
         return "❌ Transaction cancelled."
 
 
-# Tool 3 - sell stocks for a given company
+# Tool 4 - sell stocks for a given company
 @tool
 def sell_stocks(ticker_symbol: str, quantity: int, total_price: float) -> str:
     """
@@ -114,7 +181,7 @@ def sell_stocks(ticker_symbol: str, quantity: int, total_price: float) -> str:
         return "❌ Transaction cancelled."
 
 
-# tool 4 - get current date and time
+# tool 5 - get current date and time
 @tool
 def get_current_datetime() -> str:
     """
@@ -125,15 +192,14 @@ def get_current_datetime() -> str:
 
 
 # Toolkit of the agent
-tools = [get_stock_price, buy_stocks, sell_stocks, get_current_datetime]
-
+tools = [get_stock_price, get_stock_prices, buy_stocks, sell_stocks, get_current_datetime]
 
-# ----------------- Initialize Session State ----------------- #
 
-if 'memory' not in st.session_state:
-    st.session_state.memory = MemorySaver()
+# ----------------- Graph Building ----------------- #
 
-if 'app' not in st.session_state:
+@st.cache_resource
+def build_app():
+    """Compile the agent once per process, every session shares it."""
     # LLM initialization
     llm = ChatGroq(model="openai/gpt-oss-120b",
                    temperature=0.3).bind_tools(tools=tools)
@@ -148,7 +214,6 @@ if 'app' not in st.session_state:
         response = llm.invoke([system_prompt] + state["messages"])
         return {"messages": [response]}
 
-    # Graph Building
     graph = StateGraph(AgentState)
     graph.add_node("agent", agent)
 
@@ -159,19 +224,50 @@ if 'app' not in st.session_state:
     graph.add_conditional_edges("agent", tools_condition)
     graph.add_edge("tools", "agent")
 
-    st.session_state.app = graph.compile(checkpointer=st.session_state.memory)
+    # checkpoints live on disk, so conversations survive restarts and memory
+    # use doesn't grow with every conversation
+    conn = sqlite3.connect("stock_agent.db", check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    checkpointer = SqliteSaver(conn=conn)
+
+    return graph.compile(checkpointer=checkpointer)
+
+
+# ----------------- Initialize Session State ----------------- #
+
+st.session_state.app = build_app()
+
+# only the most recent messages are kept for display, the agent's own memory
+# lives in the checkpointer
+MAX_CHAT_HISTORY = 50
+
+
+def load_thread(thread_id: str):
+    """Restore the chat history and any pending confirmation from the checkpointer."""
+    snapshot = st.session_state.app.get_state(
+        {"configurable": {"thread_id": thread_id}})
 
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+    history = deque(maxlen=MAX_CHAT_HISTORY)
+    for message in snapshot.values.get("messages", []):
+        if isinstance(message, HumanMessage):
+            history.append({"type": "user", "content": message.content})
+        elif isinstance(message, AIMessage) and message.content:
+            history.append({"type": "agent", "content": message.content})
 
-if 'awaiting_decision' not in st.session_state:
-    st.session_state.awaiting_decision = False
+    st.session_state.thread_id = thread_id
+    st.session_state.chat_history = history
+    st.session_state.awaiting_decision = bool(snapshot.interrupts)
+    st.session_state.pending_response = (
+        {"__interrupt__": snapshot.interrupts} if snapshot.interrupts else None)
+
+    # the checkpointer is shared by all sessions, so each one needs its own
+    # thread, kept in the URL so a refresh or restart reopens it
+    st.query_params["thread_id"] = thread_id
 
-if 'pending_response' not in st.session_state:
-    st.session_state.pending_response = None
 
 if 'thread_id' not in st.session_state:
-    st.session_state.thread_id = "thread_1"
+    load_thread(st.query_params.get("thread_id") or str(uuid.uuid4()))
 
 # ----------------- Simple UI ----------------- #
 
@@ -180,21 +276,31 @@ st.caption("Ask me about stock prices, buy/sell stocks, or get current time")
 
 # Clear chat button
 if st.button("Clear Chat"):
-    st.session_state.chat_history = []
-    st.session_state.awaiting_decision = False
-    st.session_state.pending_response = None
+    load_thread(str(uuid.uuid4()))
     st.rerun()
 
 st.divider()
 
+
+def show_message(message: dict):
+    role = "user" if message["type"] == "user" else "assistant"
+    with st.chat_message(role):
+        st.write(message["content"])
+
+
+def add_message(message: dict):
+    # record the message and draw just that one, instead of rerunning the
+    # script to redraw the whole history
+    st.session_state.chat_history.append(message)
+    with chat_container:
+        show_message(message)
+
+
 # Display chat history
-for message in st.session_state.chat_history:
-    if message["type"] == "user":
-        with st.chat_message("user"):
-            st.write(message["content"])
-    else:
-        with st.chat_message("assistant"):
-            st.write(message["content"])
+chat_container = st.container()
+with chat_container:
+    for message in st.session_state.chat_history:
+        show_message(message)
 
 # Handle pending decision (buy/sell confirmation)
 if st.session_state.awaiting_decision and st.session_state.pending_response:
@@ -235,8 +341,7 @@ user_input = st.chat_input("What's the price of Tesla?",
 
 if user_input:
     # Show user message
-    st.session_state.chat_history.append(
-        {"type": "user", "content": user_input})
+    add_message({"type": "user", "content": user_input})
 
     # Get agent response
     config = {"configurable": {"thread_id": st.session_state.thread_id}}
@@ -246,16 +351,12 @@ if user_input:
             "messages": [{"role": "user", "content": user_input}]
         }, config=config)
 
-    # Check if needs confirmation
+    agent_msg = response['messages'][-1].content
+    add_message({"type": "agent", "content": agent_msg})
+
+    # Check if needs confirmation, the rerun shows the Yes/No buttons and
+    # disables the chat input
     if response.get("__interrupt__"):
-        agent_msg = response['messages'][-1].content
-        st.session_state.chat_history.append(
-            {"type": "agent", "content": agent_msg})
         st.session_state.awaiting_decision = True
         st.session_state.pending_response = response
-    else:
-        agent_msg = response['messages'][-1].content
-        st.session_state.chat_history.append(
-            {"type": "agent", "content": agent_msg})
-
-    st.rerun()
+        st.rerun()